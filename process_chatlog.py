@@ -1,122 +1,433 @@
 #!/usr/bin/env python3
 import pandas as pd
+import numpy as np
 import re
 from bs4 import BeautifulSoup
+import xlsxwriter
 import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import zlib
 from datetime import datetime
-import spacy
 import warnings
 warnings.filterwarnings('ignore')
 
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_sm")
-except:
-    print("Warning: Could not load spaCy model. Some PII detection may be limited.")
-    nlp = None
+# NER models are loaded on first use by _load_ner_models, so the regex worker processes
+# scrub_pii_batch starts (which re-import this module under spawn) never load them
+nlp = None
+onnx_ner = None
+_ner_models_loaded = False
+
+def _load_spacy_ner():
+    """Load the spaCy model, or return None if unavailable"""
+    try:
+        import spacy
+        # Only doc.ents is used, so skip the tagger, parser, and lemmatizer passes
+        return spacy.load("en_core_web_sm", disable=["tagger", "parser", "lemmatizer", "attribute_ruler"])
+    except:
+        print("Warning: Could not load spaCy model. Some PII detection may be limited.")
+        return None
+
+
+# Optional int8-quantized ONNX NER model, used instead of spaCy when present. Export a distilled
+# model (a full BERT-base NER model is slower than en_core_web_sm even at int8) and build it with:
+#   optimum-cli export onnx --model dslim/distilbert-NER --task token-classification ner-onnx/
+#   optimum-cli onnxruntime quantize --avx512_vnni --onnx_model ner-onnx/ -o ner-onnx-int8/
+ONNX_NER_MODEL_DIR = "ner-onnx-int8"
+# Map the model's entity groups onto the spaCy labels scrub_pii checks
+ONNX_NER_LABELS = {"PER": "PERSON", "PERSON": "PERSON", "ORG": "ORG", "LOC": "LOC", "GPE": "GPE"}
+# Tokens shared by consecutive chunks when a text is longer than the model's input limit
+ONNX_NER_STRIDE = 128
+
+def _load_onnx_ner(model_dir):
+    """Load a quantized ONNX token-classification pipeline, or return None if unavailable"""
+    if not os.path.isdir(model_dir):
+        return None
+    try:
+        from optimum.onnxruntime import ORTModelForTokenClassification
+        from transformers import AutoTokenizer, pipeline
+        model = ORTModelForTokenClassification.from_pretrained(model_dir, file_name="model_quantized.onnx")
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        # The model only sees model_max_length tokens (512 for DistilBERT), so split longer texts into
+        # overlapping chunks rather than silently leaving entities past the limit unmasked
+        return pipeline("token-classification", model=model, tokenizer=tokenizer, aggregation_strategy="simple",
+                        stride=ONNX_NER_STRIDE)
+    except Exception as e:
+        print(f"Warning: Could not load ONNX NER model from {model_dir}, using spaCy instead. Error: {e}")
+        return None
+
+def _load_ner_models():
+    """Load the ONNX NER backend the first time scrubbing needs it, falling back to spaCy"""
+    global nlp, onnx_ner, _ner_models_loaded
+    if not _ner_models_loaded:
+        onnx_ner = _load_onnx_ner(ONNX_NER_MODEL_DIR)
+        # spaCy is only used without the ONNX model, so don't load it (or warn about it) otherwise
+        nlp = _load_spacy_ner() if onnx_ner is None else None
+        _ner_models_loaded = True
 
 POSTAL_CODE_PATTERN = r"[A-Za-z]\s*\d\s*[A-Za-z]\s*[ -]?\s*\d\s*[A-Za-z]\s*\d"
 PASSPORT_PATTERN = r"\b([A-Za-z]{2}\s*\d{6})\b"
-SIN_PATTERN = r"(\d{3}\s*\d{3}\s*\d{3}|\d{3}\D*\d{3}\D*\d{3})"
-PHONE_PATTERN_1 = r"(\+\d{1,2}\s?)?1?\-?\.\s?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"
+# SIN digit groups may be split by a short run of separators, but not by arbitrary text
+SIN_PATTERN = r"\d{3}\D{0,3}\d{3}\D{0,3}\d{3}"
+PHONE_PATTERN_1 = r"(?:\+\d{1,2}\s?)?(?:1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"
 PHONE_PATTERN_2 = r"(?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?([2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?([0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(\d+))?"
 EMAIL_PATTERN = r"([a-zA-Z0-9_\-\.]+)\s*@([\sa-zA-Z0-9_\-\.]+)[\.\,]([a-zA-Z]{1,5})"
 # Regex for detecting common Date of Birth formats
 DOB_PATTERN = r"\b(\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}|\d{4}[-/.]\d{1,2}[-/.]\d{1,2})\b"
+# Dates of birth, phone numbers, and SINs as one alternation. Dates need separators, so they
+# go first; the 7-digit local form of PHONE_PATTERN_2 must end on a word boundary so it does not
+# claim the start of a longer number, and the 10-digit phone shapes go before the 9-digit SIN.
+DIGIT_PII_PATTERN = ("(?:" + DOB_PATTERN + ")|(?:" + PHONE_PATTERN_2 + r")\b|(?:" + PHONE_PATTERN_1 + ")|(?:" + SIN_PATTERN + ")")
 # Regex for detecting PO Box and General Delivery addresses
 PO_BOX_PATTERN = r"\b(?:P(?:ost(?:al)?)?\.?\s*O(?:ffice)?\.?\s*Box|General Delivery)\s+\d+\b"
 # Regex for detecting common street address formats
 ADDRESS_PATTERN = r"\b[A-Za-z0-9]+\s+[A-Za-z0-9\s.-]+\s+(?:Street|St|Avenue|Ave|Road|Rd|Lane|Ln|Drive|Dr|Boulevard|Blvd|Crescent|Cres|Court|Ct)\b"
-# Pattern to temporarily identify credit card numbers to prevent their accidental scrubbing.
+# Every ADDRESS_PATTERN match ends in one of these suffixes after whitespace, and every
+# PO_BOX_PATTERN match contains "Box" or "General Delivery"
+ADDRESS_SUFFIXES = ["Street", "St", "Avenue", "Ave", "Road", "Rd", "Lane", "Ln", "Drive", "Dr",
+                    "Boulevard", "Blvd", "Crescent", "Cres", "Court", "Ct"]
+ADDRESS_LITERAL_PATTERN = r"(?:\s(?:" + "|".join(ADDRESS_SUFFIXES) + r")|General Delivery|Box)\b"
+# Pattern to identify credit card numbers to prevent their accidental scrubbing.
 TEMP_CREDIT_CARD_IGNORE_PATTERN = r"\b(?:\d{4}[ -]?\d{4}[ -]?\d{4}[ -]?\d{1,4}|\d{13,16})\b"
 
+# Prefer Google RE2 (pip install google-re2) for linear-time matching, fall back to re
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+def _compile(pattern):
+    """Compile a case-insensitive pattern with RE2 if available, otherwise with re"""
+    if re2 is not None:
+        try:
+            return re2.compile("(?i)" + pattern)
+        except Exception:
+            pass # Pattern uses syntax RE2 does not support
+    return re.compile(pattern, re.IGNORECASE)
+
+# PII patterns in the order scrub_pii prefers them when several match at the same position
+PII_PATTERNS = [POSTAL_CODE_PATTERN, PASSPORT_PATTERN, DIGIT_PII_PATTERN, EMAIL_PATTERN, PO_BOX_PATTERN, ADDRESS_PATTERN]
+
+# Compile all patterns once at import instead of on every scrub_pii call. Credit card numbers
+# are found first and only the text between them is matched, so no PII match can swallow one.
+_PII_PATTERN = "|".join("(?:" + pattern + ")" for pattern in PII_PATTERNS)
+_PII_RE = _compile(_PII_PATTERN)
+_CC_RE = _compile(TEMP_CREDIT_CARD_IGNORE_PATTERN)
+
+# RE2 and Hyperscan only treat ASCII characters as \d, \s and \w, while re is Unicode-aware,
+# so rows with such characters (full-width digits, no-break spaces) are matched with re instead
+_UNICODE_PII_RE = re.compile(_PII_PATTERN, re.IGNORECASE)
+_UNICODE_CC_RE = re.compile(TEMP_CREDIT_CARD_IGNORE_PATTERN, re.IGNORECASE)
+# Characters the engines disagree on: non-ASCII \w (which covers \d and the case-folding letters)
+# and \s, plus the ASCII controls re counts as \s but RE2 or Hyperscan do not. Other non-ASCII
+# text such as smart quotes, dashes and emoji stays on the linear-time engines.
+_ENGINE_SPECIFIC_CHAR_RE = re.compile(r"(?![\x00-\x7f])[\w\s]|[\x0b\x1c-\x1f]")
+
+# Every pattern except email (which needs an @) and street address needs a digit, so
+# digit-free text only has to be checked against those two
+_DIGIT_RE = re.compile(r"\d")
+_EMAIL_ADDRESS_RE = _compile("(?:" + EMAIL_PATTERN + ")|(?:" + ADDRESS_PATTERN + ")")
+_ADDRESS_RE = _compile(ADDRESS_PATTERN)
+_EMAIL_RE = _compile(EMAIL_PATTERN)
+
+# Without an address literal the address and PO box patterns cannot match, so the combined
+# pattern can leave out their (backtracking-heavy) alternatives
+_NON_ADDRESS_PII_RE = _compile("|".join(
+    "(?:" + pattern + ")" for pattern in PII_PATTERNS if pattern not in (PO_BOX_PATTERN, ADDRESS_PATTERN)))
+# Compiled with re so its Unicode \s accepts everything RE2's ASCII \s does
+_ADDRESS_LITERAL_RE = re.compile(ADDRESS_LITERAL_PATTERN, re.IGNORECASE)
+
+# Prefer an Aho-Corasick automaton (pip install ahocorasick-rs) for the address literal check
+try:
+    from ahocorasick_rs import AhoCorasick, MatchKind
+    _ADDRESS_AC = AhoCorasick([suffix.lower() for suffix in ADDRESS_SUFFIXES] + ["general delivery", "box"],
+                              matchkind=MatchKind.Standard)
+except ImportError:
+    _ADDRESS_AC = None
+# Non-ASCII characters that case-insensitive matching treats as ASCII letters; each maps to
+# one character so indexes into the folded text line up with the original
+_AC_FOLD = str.maketrans("\u0130\u0131\u017f\u212a", "iisk")
+
+# Optionally check all PII patterns in a single pass with Hyperscan to skip segments with no PII (pip install hyperscan)
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+def _build_hyperscan_db():
+    """Compile PII_PATTERNS into one Hyperscan database, or return None if unavailable"""
+    if hyperscan is None:
+        return None
+    expressions = PII_PATTERNS
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8
+    try:
+        db = hyperscan.Database()
+        db.compile(expressions=[pattern.encode() for pattern in expressions],
+                   ids=list(range(len(expressions))),
+                   flags=[flags] * len(expressions))
+        return db
+    except Exception:
+        return None
+
+_HS_DB = _build_hyperscan_db()
+
+def _hyperscan_matches(text):
+    """Return whether any PII pattern matches text, stopping the Hyperscan scan at the first match"""
+    try:
+        # Returning True from the handler halts the scan, which Hyperscan reports as ScanTerminated
+        _HS_DB.scan(text.encode("utf-8"), match_event_handler=lambda *match: True)
+    except hyperscan.ScanTerminated:
+        return True
+    return False
+
+# Prefer selectolax's C lexbor parser (pip install selectolax) over BeautifulSoup for clean_html
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+def _is_missing(value):
+    """Cheap scalar replacement for pd.isna on a single cell value"""
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value)
+
 def clean_html(text):
     """Remove HTML tags from text"""
-    if pd.isna(text):
+    if _is_missing(text):
+        return text
+    text = str(text)
+    # Plain text with no tags or entities has nothing to strip, so skip the parser
+    if "<" not in text and "&" not in text:
         return text
-    soup = BeautifulSoup(str(text), 'html.parser')
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(text)
+        tree.strip_tags(["script", "style"]) # Match get_text(), which leaves these out
+        return tree.text()
+    soup = BeautifulSoup(text, 'html.parser')
     return soup.get_text()
 
-def scrub_pii(text):
-    """Remove personally identifiable information from text"""
-    if pd.isna(text):
+def _is_ascii_word_char(char):
+    """ASCII-only word character test, so the address prefilter never rejects a \\b that re or RE2 would accept"""
+    return char.isascii() and (char.isalnum() or char == "_")
+
+def _has_address_literal(text):
+    """Cheap address prefilter: look for a street suffix after whitespace, Box, or General Delivery"""
+    if _ADDRESS_AC is None:
+        return _ADDRESS_LITERAL_RE.search(text) is not None
+    folded = text.translate(_AC_FOLD).lower()
+    for literal_id, start, end in _ADDRESS_AC.find_matches_as_indexes(folded, overlapping=True):
+        # Both address patterns need a word boundary after the literal
+        if end < len(text) and _is_ascii_word_char(text[end - 1]) and _is_ascii_word_char(text[end]):
+            continue
+        if literal_id < len(ADDRESS_SUFFIXES) and (start == 0 or not text[start - 1].isspace()):
+            continue
+        return True
+    return False
+
+def _scrub_segment(text):
+    """Replace regex-detected PII with *** in a single pass over text that holds no credit card number"""
+    if not _DIGIT_RE.search(text):
+        if not _has_address_literal(text):
+            return _EMAIL_RE.sub("***", text) if "@" in text else text
+        return (_EMAIL_ADDRESS_RE if "@" in text else _ADDRESS_RE).sub("***", text)
+    # Hyperscan only decides whether the segment needs scrubbing; re/RE2 still pick the matches, so output
+    # does not depend on whether it is installed
+    if _HS_DB is not None and not _hyperscan_matches(text):
         return text
-    
-    text = str(text)
+    return (_PII_RE if _has_address_literal(text) else _NON_ADDRESS_PII_RE).sub("***", text)
 
-    # BEGIN CC IGNORE/RESTORE LOGIC
-    cc_matches = []
-    def cc_match_replacer(match):
-        cc_matches.append(match.group(0))
-        return f"@@TEMP_CC_PLACEHOLDER_{len(cc_matches)-1}@@"
-
-    text = re.sub(TEMP_CREDIT_CARD_IGNORE_PATTERN, cc_match_replacer, text, flags=re.IGNORECASE)
-    # END CC IGNORE LOGIC (part 1)
-    
-    # Replace patterns with ***
-    text = re.sub(POSTAL_CODE_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PASSPORT_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(SIN_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PHONE_PATTERN_1, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PHONE_PATTERN_2, "***", text, flags=re.IGNORECASE)
-    text = re.sub(EMAIL_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(DOB_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PO_BOX_PATTERN, "***", text, flags=re.IGNORECASE) # Added PO Box scrubbing
-    text = re.sub(ADDRESS_PATTERN, "***", text, flags=re.IGNORECASE) # Modified Address scrubbing
-    
-    # Use spaCy to detect and replace person names, organizations, and locations
-    if nlp:
-        try:
-            doc = nlp(text)
-            # BEGIN UPDATED spaCy entity processing logic
-            ents_to_scrub = []
-            for ent in doc.ents:
-                # Check for common acronyms that might be misclassified by spaCy
-                if ent.text.upper() in ["PII", "DOB"] and ent.label_ in ["ORG", "PERSON", "PRODUCT", "WORK_OF_ART", "LAW", "EVENT"]: 
-                    # print(f"Skipping false positive entity: {ent.text} ({ent.label_})") # Optional: for debugging
-                    pass
-                elif ent.label_ in ["PERSON", "ORG", "GPE", "LOC"]:
-                    ents_to_scrub.append(ent)
-            
-            # Process in reverse to maintain character positions correctly during substitution
-            for ent in reversed(ents_to_scrub):
-                text = text[:ent.start_char] + "***" + text[ent.end_char:]
-            # END UPDATED spaCy entity processing logic
-        except Exception as e: # Catch specific exceptions if known, or general Exception
-            # print(f"SpaCy processing error: {e}") # Optional: for debugging
+def _scrub_unicode_segment(text):
+    """Replace regex-detected PII with *** using re, for text other engines would match differently"""
+    if not _DIGIT_RE.search(text) and "@" not in text and not _has_address_literal(text):
+        return text
+    return _UNICODE_PII_RE.sub("***", text)
+
+def _matches_like_re(text):
+    """Check whether RE2 and Hyperscan see the same \\d, \\s and \\w characters in text as re"""
+    return not _ENGINE_SPECIFIC_CHAR_RE.search(text)
+
+def _card_re(text):
+    """Return the credit card regex that matches text the way re would"""
+    return _CC_RE if _matches_like_re(text) else _UNICODE_CC_RE
+
+def _regex_scrub(text):
+    """Replace regex-detected PII with ***, leaving credit card numbers untouched"""
+    scrub_segment = _scrub_segment if _matches_like_re(text) else _scrub_unicode_segment
+    if not _DIGIT_RE.search(text):
+        return scrub_segment(text)
+    # Scrub only the text around each card number, so no PII match can run into one
+    pieces = []
+    prev = 0
+    for match in _card_re(text).finditer(text):
+        pieces.append(scrub_segment(text[prev:match.start()]))
+        pieces.append(match.group(0))
+        prev = match.end()
+    pieces.append(scrub_segment(text[prev:]))
+    return "".join(pieces)
+
+def _has_uppercase(text):
+    """Cheap NER prefilter: names, organizations, and places are capitalized"""
+    return text != text.lower()
+
+def _spacy_entities(doc):
+    """Return (start_char, end_char, label) tuples for the entities in a spaCy doc"""
+    return [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+
+def _onnx_entities(results):
+    """Return (start_char, end_char, label) tuples for ONNX pipeline results, using spaCy label names"""
+    return [(r["start"], r["end"], ONNX_NER_LABELS.get(r["entity_group"], r["entity_group"])) for r in results]
+
+def _apply_ner_replacements(text, entities):
+    """Replace the person names, organizations, and locations among (start, end, label) entities with ***"""
+    # BEGIN UPDATED entity processing logic
+    ents_to_scrub = []
+    for start, end, label in entities:
+        # Check for common acronyms that might be misclassified by the NER model
+        if text[start:end].upper() in ["PII", "DOB"] and label in ["ORG", "PERSON", "PRODUCT", "WORK_OF_ART", "LAW", "EVENT"]: 
+            # print(f"Skipping false positive entity: {text[start:end]} ({label})") # Optional: for debugging
             pass
+        elif label in ["PERSON", "ORG", "GPE", "LOC"]:
+            ents_to_scrub.append((start, end))
     
-    # BEGIN CC RESTORE LOGIC (part 2)
-    idx = 0
-    while True: # Loop as long as placeholders are found
-        placeholder_to_find = f"@@TEMP_CC_PLACEHOLDER_{idx}@@"
-        if placeholder_to_find in text:
-            if idx < len(cc_matches): # Check if we have a corresponding original CC
-                text = text.replace(placeholder_to_find, cc_matches[idx], 1) # Replace one instance
-            else:
-                # This case should ideally not happen if logic is correct
-                text = text.replace(placeholder_to_find, "[UNEXPECTED_CC_PLACEHOLDER]", 1) # Avoid using *** for this
-            idx += 1
+    # Credit card numbers are kept in the text, so never let an entity replacement cover one
+    if ents_to_scrub:
+        cc_spans = [match.span() for match in _card_re(text).finditer(text)]
+        ents_to_scrub = [ent for ent in ents_to_scrub if not any(ent[0] < cc_end and cc_start < ent[1] for cc_start, cc_end in cc_spans)]
+    
+    # Splice *** in with a single join rather than rebuilding the string for every entity
+    pieces = []
+    prev = 0
+    for start, end in sorted(ents_to_scrub):
+        if start >= prev:
+            pieces.append(text[prev:start])
+            pieces.append("***")
+        prev = max(prev, end)
+    pieces.append(text[prev:])
+    text = "".join(pieces)
+    # END UPDATED entity processing logic
+    return text
+
+def _scrub_entities(text):
+    """Run NER over a single text and replace its entities, leaving the text unchanged on error"""
+    try:
+        if onnx_ner is not None:
+            entities = _onnx_entities(onnx_ner(text))
         else:
-            break # No more placeholders with the current idx, exit loop
-    # END CC RESTORE LOGIC
+            entities = _spacy_entities(nlp(text))
+        return _apply_ner_replacements(text, entities)
+    except Exception as e: # Catch specific exceptions if known, or general Exception
+        # print(f"NER processing error: {e}") # Optional: for debugging
+        return text
 
+@lru_cache(maxsize=65536)
+def _scrub_pii_str(text):
+    """Scrub PII from a string, caching results since chat logs repeat the same questions"""
+    text = _regex_scrub(text)
+    
+    # Use NER to detect and replace person names, organizations, and locations
+    _load_ner_models()
+    if (onnx_ner is not None or nlp) and _has_uppercase(text):
+        text = _scrub_entities(text)
+    
     return text
 
+def scrub_pii(text):
+    """Remove personally identifiable information from text"""
+    if _is_missing(text):
+        return text
+    return _scrub_pii_str(str(text))
+
+def scrub_pii_batch(texts, chunksize=256):
+    """Scrub PII from a list of texts, batching the regex and NER stages across processes"""
+    results = list(texts)
+    indices = [i for i, text in enumerate(texts) if not _is_missing(text)]
+    # Duplicate rows (canned questions, boilerplate prompts) are scrubbed once and mapped back
+    inputs = list(dict.fromkeys(str(texts[i]) for i in indices))
+    
+    # Small inputs are not worth the cost of starting worker processes
+    parallel = len(inputs) >= chunksize * 2 and (os.cpu_count() or 1) > 1
+    
+    # Regex stage: each worker imports this module, so patterns are compiled once per process
+    if parallel:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            scrubbed = list(executor.map(_regex_scrub, inputs, chunksize=chunksize))
+    else:
+        scrubbed = [_regex_scrub(text) for text in inputs]
+    
+    # NER stage: batch the column instead of re-entering the model per row, skipping rows with no capitals.
+    # Models load only after the pool has shut down, so its workers never fork a loaded model.
+    _load_ner_models()
+    if onnx_ner is not None or nlp:
+        ner_indices = [i for i, text in enumerate(scrubbed) if _has_uppercase(text)]
+        ner_inputs = [scrubbed[i] for i in ner_indices]
+        try:
+            if onnx_ner is not None:
+                entity_lists = [_onnx_entities(results) for results in onnx_ner(ner_inputs, batch_size=128)]
+            else:
+                docs = nlp.pipe(ner_inputs, batch_size=128, n_process=-1 if parallel else 1)
+                entity_lists = [_spacy_entities(doc) for doc in docs]
+            for i, text, entities in zip(ner_indices, ner_inputs, entity_lists):
+                scrubbed[i] = _apply_ner_replacements(text, entities)
+        except Exception as e: # Fall back to row-by-row so one bad row cannot fail the batch
+            # print(f"NER batch processing error: {e}") # Optional: for debugging
+            for i, text in zip(ner_indices, ner_inputs):
+                scrubbed[i] = _scrub_entities(text)
+    
+    scrubbed_by_input = dict(zip(inputs, scrubbed))
+    for i in indices:
+        results[i] = scrubbed_by_input[str(texts[i])]
+    return results
+
 def generate_session_colors(df):
     """Generate color codes for duplicate session IDs"""
-    session_counts = df['SessionId'].value_counts()
-    duplicate_sessions = session_counts[session_counts > 1].index
+    session_ids = df['SessionId']
+    duplicate_sessions = session_ids[session_ids.duplicated(keep=False) & session_ids.notna()].unique()
     
     # Generate colors for duplicates
     colors = ['#FFB6C1', '#98FB98', '#87CEEB', '#DDA0DD', '#F0E68C', 
               '#FFA07A', '#20B2AA', '#B0C4DE', '#FAFAD2', '#D8BFD8']
     
-    session_colors = {}
-    for i, session in enumerate(duplicate_sessions):
-        session_colors[session] = colors[i % len(colors)]
+    # Pick each color from a stable hash of the session ID (hash() of a str changes between runs)
+    return {session: colors[zlib.crc32(str(session).encode("utf-8")) % len(colors)]
+            for session in duplicate_sessions}
+
+def _column_widths(df):
+    """Return auto-fit column widths for df: the longest header or value per column plus padding, capped at 50"""
+    widths = []
+    # One vectorized length pass per column instead of measuring every cell while writing
+    for col, values in df.items():
+        if pd.api.types.is_datetime64_any_dtype(values):
+            # Measure datetimes as written (YYYY-MM-DD HH:MM:SS), since str() drops the time from all-midnight columns
+            strings = values.dt.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            strings = values.astype(str)
+        longest = strings.str.len().where(values.notna()).max()
+        widths.append(max(len(str(col)), 0 if pd.isna(longest) else int(longest)))
+    return np.minimum(np.array(widths, dtype=int) + 2, 50)
+
+def _write_sheet(workbook, sheet_name, df, header_format=None, column_formats=None):
+    """Write df to a new worksheet one row at a time, as constant_memory mode requires"""
+    # column_formats maps a column index to a {row index: cell format} dict for the rows that need one
+    column_formats = column_formats or {}
+    worksheet = workbook.add_worksheet(sheet_name)
+    
+    for col_idx, col in enumerate(df.columns):
+        worksheet.write(0, col_idx, col, header_format)
     
-    return session_colors
+    for row_idx, row in enumerate(df.itertuples(index=False, name=None)):
+        for col_idx, value in enumerate(row):
+            if _is_missing(value):
+                continue
+            cell_format = column_formats[col_idx].get(row_idx) if col_idx in column_formats else None
+            try:
+                worksheet.write(row_idx + 1, col_idx, value, cell_format)
+            except TypeError: # Types xlsxwriter does not know are written as text, like to_excel does
+                worksheet.write_string(row_idx + 1, col_idx, str(value), cell_format)
+    
+    # Auto-adjust column widths
+    for col_idx, width in enumerate(_column_widths(df)):
+        worksheet.set_column(col_idx, col_idx, int(width))
+    return worksheet
 
 def process_excel_file(input_file, output_file):
     """Process the Excel file with all required transformations"""
@@ -128,19 +439,20 @@ def process_excel_file(input_file, output_file):
     # Clean HTML from RawAnswer.Answer column
     if 'RawAnswer.Answer' in df.columns:
         print("Cleaning HTML tags from RawAnswer.Answer column...")
-        df['RawAnswer.Answer_Cleaned'] = df['RawAnswer.Answer'].apply(clean_html)
+        df['RawAnswer.Answer_Cleaned'] = [clean_html(x) for x in df['RawAnswer.Answer'].tolist()]
     
     # Scrub PII from UserQuestion column only
     if 'UserQuestion' in df.columns:
         print("Scrubbing PII from UserQuestion column...")
-        df['UserQuestion_Scrubbed'] = df['UserQuestion'].apply(scrub_pii)
+        df['UserQuestion_Scrubbed'] = scrub_pii_batch(df['UserQuestion'].tolist())
     
     # Calculate userSatisfactionIndicator statistics (lowercase 'u')
     summary_data = {}
     if 'userSatisfactionIndicator' in df.columns:
         print("\nCalculating userSatisfactionIndicator statistics...")
-        satisfaction_counts = df['userSatisfactionIndicator'].value_counts()
-        total = len(df[df['userSatisfactionIndicator'].notna()])
+        indicators = df['userSatisfactionIndicator']
+        satisfaction_counts = indicators.value_counts()
+        total = int(indicators.notna().sum())
         
         print("\n=== UserSatisfactionIndicator Statistics ===")
         for indicator, count in satisfaction_counts.items():
@@ -148,8 +460,10 @@ def process_excel_file(input_file, output_file):
             print(f"{indicator}: {count} ({percentage:.2f}%)")
         
         # Separate up/down statistics
-        up_count = df[df['userSatisfactionIndicator'].str.contains('up', case=False, na=False)].shape[0]
-        down_count = df[df['userSatisfactionIndicator'].str.contains('down', case=False, na=False)].shape[0]
+        # Lowercase once and use plain substring checks instead of two case-insensitive regex scans
+        lowered = indicators.str.lower()
+        up_count = int(lowered.str.contains('up', regex=False, na=False).sum())
+        down_count = int(lowered.str.contains('down', regex=False, na=False).sum())
         
         if total > 0:
             up_percentage = (up_count/total)*100
@@ -167,53 +481,37 @@ def process_excel_file(input_file, output_file):
     # Generate session colors for duplicates
     session_colors = generate_session_colors(df)
     
-    # Write to Excel with formatting
+    # Write to Excel with formatting, streaming rows to disk instead of building the workbook in memory
     print(f"\nWriting processed data to: {output_file}")
-    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Processed Data', index=False)
-        
-        # Add summary sheet if we have satisfaction data
-        if summary_data:
-            summary_df = pd.DataFrame(summary_data)
-            summary_df.to_excel(writer, sheet_name='Satisfaction Summary', index=False)
-        
-        # Get the workbook and worksheet
-        workbook = writer.book
-        worksheet = writer.sheets['Processed Data']
+    workbook = xlsxwriter.Workbook(output_file, {
+        'constant_memory': True,
+        'default_date_format': 'YYYY-MM-DD HH:MM:SS',
+        'remove_timezone': True,
+        'strings_to_urls': False,
+    })
+    try:
+        # Bold, bordered, centered headers, as to_excel writes them
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
         
         # Apply color coding to duplicate SessionIds
-        from openpyxl.styles import PatternFill
-        
-        # Find SessionId column
-        session_col = None
-        for idx, col in enumerate(df.columns, 1):
-            if col == 'SessionId':
-                session_col = idx
-                break
-        
-        if session_col:
-            for row_idx, session_id in enumerate(df['SessionId'], 2):  # Start from row 2 (after header)
-                if session_id in session_colors:
-                    cell = worksheet.cell(row=row_idx, column=session_col)
-                    fill = PatternFill(start_color=session_colors[session_id].replace('#', ''),
-                                     end_color=session_colors[session_id].replace('#', ''),
-                                     fill_type='solid')
-                    cell.fill = fill
+        column_formats = {}
+        if 'SessionId' in df.columns:
+            # Build the session -> format map once and only visit the rows whose session repeats
+            color_formats = {color: workbook.add_format({'bg_color': color, 'pattern': 1})
+                             for color in set(session_colors.values())}
+            session_formats = {session_id: color_formats[color] for session_id, color in session_colors.items()}
+            session_ids = df['SessionId']
+            colored_rows = np.flatnonzero(session_ids.isin(session_formats.keys()).to_numpy())
+            column_formats[df.columns.get_loc('SessionId')] = dict(
+                zip(colored_rows.tolist(), session_ids.iloc[colored_rows].map(session_formats).tolist())
+            )
+        _write_sheet(workbook, 'Processed Data', df, header_format, column_formats)
         
-        # Auto-adjust column widths for all sheets
-        for sheet_name in writer.sheets:
-            worksheet = writer.sheets[sheet_name]
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
+        # Add summary sheet if we have satisfaction data
+        if summary_data:
+            _write_sheet(workbook, 'Satisfaction Summary', pd.DataFrame(summary_data), header_format)
+    finally:
+        workbook.close()
     
     print(f"\nProcessing complete! Output saved to: {output_file}")
 
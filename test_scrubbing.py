@@ -1,90 +1,15 @@
-import re
-import pandas as pd # pandas is used by scrub_pii for pd.isna
-import spacy
-
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_sm")
+# Test the scrubbing logic shipped in process_chatlog.py rather than a hand-synced copy
+import pandas as pd
+import process_chatlog
+from process_chatlog import (scrub_pii, _ADDRESS_LITERAL_RE, _has_address_literal, _regex_scrub, _matches_like_re,
+                             _onnx_entities, _apply_ner_replacements, _scrub_entities, scrub_pii_batch, _column_widths)
+
+# NER models load lazily, so load them up front to report which backend is in use
+process_chatlog._load_ner_models()
+if process_chatlog.onnx_ner is not None:
+    print("ONNX NER model loaded successfully.")
+elif process_chatlog.nlp:
     print("spaCy model en_core_web_sm loaded successfully.")
-except Exception as e:
-    print(f"Warning: Could not load spaCy model. Some PII detection may be limited. Error: {e}")
-    nlp = None
-
-# Regex patterns from the updated process_chatlog.py
-POSTAL_CODE_PATTERN = r"[A-Za-z]\s*\d\s*[A-Za-z]\s*[ -]?\s*\d\s*[A-Za-z]\s*\d" # Kept for completeness, though not explicitly tested here
-PASSPORT_PATTERN = r"\b([A-Za-z]{2}\s*\d{6})\b"
-SIN_PATTERN = r"(\d{3}\s*\d{3}\s*\d{3}|\d{3}\D*\d{3}\D*\d{3})"
-PHONE_PATTERN_1 = r"(\+\d{1,2}\s?)?1?\-?\.\s?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"
-PHONE_PATTERN_2 = r"(?:(?:\+?1\s*(?:[.-]\s*)?)?(?:\(\s*([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9])\s*\)|([2-9]1[02-9]|[2-9][02-8]1|[2-9][02-8][02-9]))\s*(?:[.-]\s*)?)?([2-9]1[02-9]|[2-9][02-9]1|[2-9][02-9]{2})\s*(?:[.-]\s*)?([0-9]{4})(?:\s*(?:#|x\.?|ext\.?|extension)\s*(\d+))?"
-EMAIL_PATTERN = r"([a-zA-Z0-9_\-\.]+)\s*@([\sa-zA-Z0-9_\-\.]+)[\.\,]([a-zA-Z]{1,5})"
-DOB_PATTERN = r"\b(\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}|\d{4}[-/.]\d{1,2}[-/.]\d{1,2})\b"
-# Regex for detecting PO Box and General Delivery addresses
-PO_BOX_PATTERN = r"\b(?:P(?:ost(?:al)?)?\.?\s*O(?:ffice)?\.?\s*Box|General Delivery)\s+\d+\b"
-# Regex for detecting common street address formats (updated for alphanumeric street numbers)
-ADDRESS_PATTERN = r"\b[A-Za-z0-9]+\s+[A-Za-z0-9\s.-]+\s+(?:Street|St|Avenue|Ave|Road|Rd|Lane|Ln|Drive|Dr|Boulevard|Blvd|Crescent|Cres|Court|Ct)\b"
-# Pattern to temporarily identify credit card numbers to prevent their accidental scrubbing.
-TEMP_CREDIT_CARD_IGNORE_PATTERN = r"\b(?:\d{4}[ -]?\d{4}[ -]?\d{4}[ -]?\d{1,4}|\d{13,16})\b"
-
-
-def scrub_pii(text):
-    """Remove personally identifiable information from text (with CC protection and new address logic)"""
-    if pd.isna(text):
-        return text
-    
-    text = str(text)
-
-    # BEGIN CC IGNORE/RESTORE LOGIC
-    cc_matches = []
-    def cc_match_replacer(match):
-        cc_matches.append(match.group(0))
-        return f"@@TEMP_CC_PLACEHOLDER_{len(cc_matches)-1}@@"
-
-    text = re.sub(TEMP_CREDIT_CARD_IGNORE_PATTERN, cc_match_replacer, text, flags=re.IGNORECASE)
-    # END CC IGNORE LOGIC (part 1)
-    
-    # Replace patterns with ***
-    text = re.sub(POSTAL_CODE_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PASSPORT_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(SIN_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PHONE_PATTERN_1, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PHONE_PATTERN_2, "***", text, flags=re.IGNORECASE)
-    text = re.sub(EMAIL_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(DOB_PATTERN, "***", text, flags=re.IGNORECASE)
-    text = re.sub(PO_BOX_PATTERN, "***", text, flags=re.IGNORECASE) # New PO Box scrubbing
-    text = re.sub(ADDRESS_PATTERN, "***", text, flags=re.IGNORECASE) # Modified Address scrubbing
-    
-    # Use spaCy to detect and replace person names, organizations, and locations
-    if nlp:
-        try:
-            doc = nlp(text)
-            ents_to_scrub = []
-            for ent in doc.ents:
-                if ent.text.upper() in ["PII", "DOB"] and ent.label_ in ["ORG", "PERSON", "PRODUCT", "WORK_OF_ART", "LAW", "EVENT"]: 
-                    pass 
-                elif ent.label_ in ["PERSON", "ORG", "GPE", "LOC"]:
-                    ents_to_scrub.append(ent)
-            
-            for ent in reversed(ents_to_scrub):
-                text = text[:ent.start_char] + "***" + text[ent.end_char:]
-        except Exception as e:
-            print(f"spaCy processing error: {e}") 
-            pass
-    
-    # BEGIN CC RESTORE LOGIC (part 2)
-    idx = 0
-    while True: 
-        placeholder_to_find = f"@@TEMP_CC_PLACEHOLDER_{idx}@@"
-        if placeholder_to_find in text:
-            if idx < len(cc_matches):
-                text = text.replace(placeholder_to_find, cc_matches[idx], 1) 
-            else:
-                text = text.replace(placeholder_to_find, "[UNEXPECTED_CC_PLACEHOLDER]", 1)
-            idx += 1
-        else:
-            break 
-    # END CC RESTORE LOGIC
-
-    return text
 
 # Define test data
 test_strings = [
@@ -99,6 +24,9 @@ test_strings = [
     "My Card is 1234-5678-9012-3456, thanks.",
     "Charge it to Visa 9876543210987654.",
     "AMEX card: 3742-123456-12345.",
+    "my card 1111-2222-3333-4444 please ship to 12 Elm Street",
+    "Card 1234 5678 9012 3456 on Main St",
+    "email me at bob@ 1234567812345678.com",
 
     # Personal Names
     "The agent is John Doe.",
@@ -107,18 +35,25 @@ test_strings = [
     # Dates of Birth
     "Her birthday is 05/10/1985.",
     "DOB: 1970-01-01.",
+    "born \u0660\u0665/\u0661\u0660/\u0661\u0669\u0668\u0665",  # Arabic-Indic digits
 
     # Emails
     "Contact support@example.com for help.",
 
     # Phone numbers
     "Call us at (555) 123-4567 or 555.987.6543.",
+    "call \uff14\uff11\uff16-\uff15\uff15\uff15-\uff10\uff11\uff19\uff19",  # Full-width digits
+    "call 416\xa0555\xa00199",  # No-break spaces
+    "Call 4165550199 today.",
+    "Ext: 613-555-0199 ext. 42",
 
     # SINs
     "My SIN is 123 456 789.",
+    "Order 123 shipped, ref 456, qty 789",  # Digit groups split by text are not a SIN
 
     # Passport numbers
     "Passport number: AB123456.",
+    "Passport AB123456 123 thanks",
 
     # No PII
     "This is a test sentence with no sensitive data.",
@@ -151,3 +86,101 @@ none_value = None
 print(f"Original: {none_value}")
 scrubbed_none = scrub_pii(none_value)
 print(f"Scrubbed: {scrubbed_none}")
+
+# Lock in the regex stage on its own, since NER output depends on the installed model
+print("\n--- Testing regex stage ---")
+expected_regex_scrub = {
+    "Order 123 shipped, ref 456, qty 789": "Order 123 shipped, ref 456, qty 789",
+    "Ext: 613-555-0199 ext. 42": "Ext: ***",
+    "Call 4165550199 today.": "Call *** today.",
+    "call 555-0199 or 123 456 789": "call *** or ***",
+    "my card 1111-2222-3333-4444 please ship to 12 Elm Street": "my card 1111-2222-3333-4444 ***",
+    "Card 1234 5678 9012 3456 on Main St": "Card 1234 5678 9012 3456 ***",
+    "email me at bob@ 1234567812345678.com": "email me at bob@ 1234567812345678.com",
+    "call \uff14\uff11\uff16-\uff15\uff15\uff15-\uff10\uff11\uff19\uff19": "call ***",
+    "born \u0660\u0665/\u0661\u0660/\u0661\u0669\u0668\u0665": "born ***",
+    "call 416\xa0555\xa00199": "call ***",
+    "call 416\x1c555\x1c0199": "call ***",
+    "I\u2019m at 416-555-0199 \u2014 thanks \U0001f600": "I\u2019m at *** \u2014 thanks \U0001f600",
+}
+for text, expected in expected_regex_scrub.items():
+    assert _regex_scrub(text) == expected, f"{text!r}: got {_regex_scrub(text)!r}, expected {expected!r}"
+print(f"_regex_scrub gives the expected output for all {len(expected_regex_scrub)} strings")
+
+# Smart quotes, dashes and emoji match the same on every engine, so they must not force the backtracking re path
+for text in ["I\u2019m at 416-555-0199 \u2014 thanks \U0001f600", "a " * 8000 + "\u2019 St x"]:
+    assert _matches_like_re(text), f"{text[:40]!r} should stay on the RE2/Hyperscan path"
+for text in ["caf\xe9", "416\xa0555", "\uff14\uff11\uff16", "a\x0bb"]:
+    assert not _matches_like_re(text), f"{text!r} should be matched with re"
+print("Only characters the engines disagree on send a row to re")
+
+# Feed canned token-classification output through the ONNX path, since the model itself is optional
+print("\n--- Testing ONNX entity mapping ---")
+onnx_text = "Ask John Smith at Acme about Python"
+onnx_results = [
+    {"start": 4, "end": 14, "entity_group": "PER", "score": 0.99, "word": "John Smith"},
+    {"start": 18, "end": 22, "entity_group": "ORG", "score": 0.97, "word": "Acme"},
+    {"start": 29, "end": 35, "entity_group": "MISC", "score": 0.91, "word": "Python"},
+]
+assert _onnx_entities(onnx_results) == [(4, 14, "PERSON"), (18, 22, "ORG"), (29, 35, "MISC")]
+assert _apply_ner_replacements(onnx_text, _onnx_entities(onnx_results)) == "Ask *** at *** about Python"
+onnx_ner = process_chatlog.onnx_ner
+process_chatlog.onnx_ner = lambda text: onnx_results if text == onnx_text else []
+try:
+    assert _scrub_entities(onnx_text) == "Ask *** at *** about Python", _scrub_entities(onnx_text)
+finally:
+    process_chatlog.onnx_ner = onnx_ner
+print("ONNX entity groups map onto the spaCy labels scrub_pii masks")
+
+# The splice merges overlapping and nested entities, and never masks a card number or the PII/DOB acronyms
+print("\n--- Testing NER replacement ---")
+card_text = "Card 1111 2222 3333 4444 from Acme"
+expected_ner_replacements = [
+    ("abc John Smith def", [(4, 14, "PERSON"), (9, 14, "PERSON"), (0, 3, "GPE")], "*** *** def"),
+    ("abc John Smith def", [(4, 9, "PERSON"), (6, 14, "ORG")], "abc *** def"),
+    (card_text, [(10, 14, "ORG"), (30, 34, "ORG")], "Card 1111 2222 3333 4444 from ***"),
+    ("My PII and DOB, Jane", [(3, 6, "ORG"), (11, 14, "PERSON"), (16, 20, "PERSON")], "My PII and DOB, ***"),
+]
+for text, entities, expected in expected_ner_replacements:
+    result = _apply_ner_replacements(text, entities)
+    assert result == expected, f"{text!r} with {entities}: got {result!r}, expected {expected!r}"
+print(f"_apply_ner_replacements gives the expected output for all {len(expected_ner_replacements)} cases")
+
+# The batch path dedupes rows and maps results back, so it must agree with scrub_pii row by row
+print("\n--- Testing batch scrubbing ---")
+batch_texts = ["Call John at 416-555-0199", None, float('nan'), 4165550199, "Call John at 416-555-0199",
+               "no pii here", "no pii here", 4165550199] + test_strings
+assert scrub_pii_batch(batch_texts) == [scrub_pii(text) for text in batch_texts], "scrub_pii_batch differs from scrub_pii"
+print(f"scrub_pii_batch matches scrub_pii on all {len(batch_texts)} rows")
+
+# Both the Aho-Corasick check and the regex fallback must accept every address and skip plain words
+expected_address_literal = {
+    "123 Main St": True, "PO Box 5": True, "POBox 5": True, "General Delivery 500": True,
+    "12 Oak\xa0Rd": True, "221B Baker Street.": True,
+    "first step": False, "reset my password": False, "the xbox360": False, "I studied drama": False,
+}
+for text, expected in expected_address_literal.items():
+    assert _has_address_literal(text) == expected, f"_has_address_literal({text!r}) should be {expected}"
+    assert bool(_ADDRESS_LITERAL_RE.search(text)) == expected, f"_ADDRESS_LITERAL_RE on {text!r} should be {expected}"
+print(f"Address literal prefilter gives the expected result for all {len(expected_address_literal)} strings")
+
+# Datetime columns are written as YYYY-MM-DD HH:MM:SS, so a date-only column still needs the full width
+dates = pd.DataFrame({"When": pd.to_datetime(["2024-01-01", "2024-01-02"]), "Note": ["hi", None]})
+assert list(_column_widths(dates)) == [21, 6], f"_column_widths gave {list(_column_widths(dates))}"
+print("_column_widths measures datetime columns by their written format")
+
+# Hyperscan only prefilters segments, so scrubbing must give the same output with and without it
+print("\n--- Testing Hyperscan parity ---")
+if process_chatlog._HS_DB is None:
+    print("Hyperscan is not installed, skipping")
+else:
+    with_hyperscan = {text: _regex_scrub(text) for text in test_strings}
+    hs_db, process_chatlog._HS_DB = process_chatlog._HS_DB, None
+    try:
+        mismatches = [text for text in test_strings if with_hyperscan[text] != _regex_scrub(text)]
+        for text in mismatches:
+            print(f"Mismatch: {text}\n  Hyperscan: {with_hyperscan[text]}\n  Python:    {_regex_scrub(text)}")
+    finally:
+        process_chatlog._HS_DB = hs_db
+    assert not mismatches, f"Hyperscan changes the output on {len(mismatches)} of {len(test_strings)} strings"
+    print(f"Hyperscan gives the same output as _PII_RE on all {len(test_strings)} strings")